@@ -1,29 +1,100 @@
 import argparse
-import json
-import multiprocessing
+import asyncio
+import os
+import orjson
 import requests
 import socket
+import struct
+import ssl
 import sys
 import tempfile
 import time
 
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
 from ipaddress import ip_network
-from typing import List, Optional, Dict, Set
-from tqdm import tqdm
-from os.path import join, isfile
+from typing import Iterator, List, Optional, Dict, Set, Union
+from tqdm.asyncio import tqdm as tqdm_asyncio
+from pathlib import Path
+
+
+# Shared across direct (unproxied) calls so repeated requests reuse pooled TCP/TLS connections
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(max_retries=0))
+_SESSION.mount('http://', HTTPAdapter(max_retries=0))
+
+_SSL_CONTEXT = ssl.create_default_context()  # loads the CA bundle once, shared by all the tunnels
+
+_DATA_PATH = Path(tempfile.gettempdir()) / 'data.json'
+_ETAG_PATH = Path(tempfile.gettempdir()) / 'data.json.etag'
+_GEO_CACHE_PATH = Path(tempfile.gettempdir()) / 'geo_cache.json'
+_GEO_CACHE_TTL = 24 * 60 * 60  # seconds
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-@dataclass
+def _atomic_write(file_path: Path, content: bytes) -> None:
+    tmp_path = file_path.with_name(f'{file_path.name}.{os.getpid()}.tmp')
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, file_path)  # atomic: readers never see a partial file
+
+
+def _geo_cache_load() -> Dict[str, list]:
+    try:
+        cache = orjson.loads(_GEO_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        return dict()
+    if not isinstance(cache, dict):  # the temp dir is shared: the file may not even be ours
+        return dict()
+    now = time.time()
+    return {
+        key: entry for key, entry in cache.items()
+        if isinstance(entry, list) and len(entry) == 2
+        and isinstance(entry[0], (int, float)) and isinstance(entry[1], str)
+        and now - entry[0] < _GEO_CACHE_TTL  # prune expired
+    }
+
+
+_GEO_CACHE: Dict[str, list] = _geo_cache_load()  # key -> [timestamp, country]
+_GEO_CACHE_DIRTY = False
+
+
+def _geo_cache_get(key: str) -> Optional[str]:
+    entry = _GEO_CACHE.get(key)
+    if entry is None or time.time() - entry[0] >= _GEO_CACHE_TTL:
+        return None
+    return entry[1]
+
+
+def _geo_cache_set(key: str, country: str) -> None:
+    global _GEO_CACHE_DIRTY
+    _GEO_CACHE[key] = [time.time(), country]
+    _GEO_CACHE_DIRTY = True
+
+
+def _geo_cache_flush() -> None:
+    """
+    Persist the cache, once per run, only if it changed.
+    """
+    global _GEO_CACHE_DIRTY
+    if not _GEO_CACHE_DIRTY:
+        return
+    try:
+        _atomic_write(_GEO_CACHE_PATH, orjson.dumps(_GEO_CACHE))
+        _GEO_CACHE_DIRTY = False
+    except OSError as e:
+        eprint(e)
+
+
+@dataclass(slots=True)
 class Geolocation:
     country: str
     city: Optional[str]
 
-@dataclass
+@dataclass(slots=True)
 class ProxyInfo:
     proxy: str
     protocol: str
@@ -32,25 +103,27 @@ class ProxyInfo:
     https: bool
     anonymity: str
     score: int
-    ping: float  # infinity for failed connections
+    ping_ns: Optional[int]  # handshake time in nanoseconds, None for failed connections
     geolocation: Geolocation
     works: bool
 
 
-def get_url(url: str, proxy: Optional[ProxyInfo] = None) -> Optional[str]:
+def get_url(url: str, proxy: Optional[ProxyInfo] = None, timeout: float = 16) -> Optional[str]:
     if not url.startswith('http'):
         eprint(f'ERROR: Only HTTP(S) URLs are supported! "{url}"')
         return None
     try:
-        proxies: Optional[dict[str, str]] = None
-        if proxy is not None:
+        if proxy is None:
+            resp = _SESSION.get(url, timeout=timeout)
+        else:
             proto = proxy.protocol.lower()
-            if proto in {"socks5", "socks4", "http", "https"}:
-                proxy_uri = f"{proto}://{proxy.ip}:{proxy.port}"
-                proxies = {"http": proxy_uri, "https": proxy_uri}
-            else:
+            if proto not in {"socks5", "socks4", "http", "https"}:
                 raise ValueError(f"Unsupported proxy protocol: {proxy.protocol!r}")
-        resp = requests.get(url, proxies=proxies, timeout=16)
+            proxy_uri = f"{proto}://{proxy.ip}:{proxy.port}"
+            # A private session per proxied call: a proxy is verified once, so there is nothing to reuse,
+            # and closing it releases its connections without touching the shared (multi-threaded) adapter
+            with requests.Session() as session:
+                resp = session.get(url, proxies={"http": proxy_uri, "https": proxy_uri}, timeout=timeout)
         if resp.ok:
             return resp.text
     except Exception as e:
@@ -59,21 +132,39 @@ def get_url(url: str, proxy: Optional[ProxyInfo] = None) -> Optional[str]:
 
 
 def geolocation_service(proxy: Optional[ProxyInfo] = None) -> Optional[str]:
-    r = get_url("https://ipinfo.io/json", proxy)
+    url = "https://ipinfo.io/json"
+    key = f"{url} {proxy.ip if proxy is not None else 'local'}"
+    country = _geo_cache_get(key)
+    if country is not None:
+        return country
+    r = get_url(url, proxy)
     if r is None:
         return None
-    return json.loads(r)["country"]
+    try:
+        country = orjson.loads(r)["country"]
+    except (ValueError, KeyError, TypeError):  # e.g. a captive HTML page instead of ipinfo's JSON
+        return None
+    _geo_cache_set(key, country)
+    return country
 
 
 def does_it_work(proxy: ProxyInfo) -> bool:
     # Assumption: the Tor Project does not block proxies :)
-    r = get_url('https://www.torproject.org/', proxy)
+    # The check API answers with a tiny JSON document, e.g. {"IsTor":false,"IP":"..."}
+    r = get_url('https://check.torproject.org/api/ip', proxy, timeout=8)
     if r is None:
         return False
-    return 'Tor Project' in r
+    return _is_tor_check_reply(r)
 
 
-def _socks4_handshake(sock: socket.socket) -> bool:
+def _is_tor_check_reply(body: Union[str, bytes]) -> bool:
+    try:
+        return orjson.loads(body).get('IsTor') is not None
+    except (ValueError, AttributeError):
+        return False
+
+
+async def _socks4_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
     """
     SOCKS 4/4a: CONNECT 1.1.1.1:80 (any public IP works)
     Success reply → VN=0x00 or 0x04 (impls differ), CD=0x5A.
@@ -81,81 +172,161 @@ def _socks4_handshake(sock: socket.socket) -> bool:
     dst_ip   = b"\x01\x01\x01\x01"         # 1.1.1.1
     dst_port = (80).to_bytes(2, "big")     # port 80
     payload  = b"\x04\x01" + dst_port + dst_ip + b"\x00"  # USERID empty
-    sock.sendall(payload)
-    reply = sock.recv(8)
-    return len(reply) >= 2 and reply[1] == 0x5A            # 0x5A = granted
+    writer.write(payload)
+    await writer.drain()
+    reply = await reader.readexactly(2)                    # only VN and CD matter
+    return reply[1] == 0x5A                                # 0x5A = granted
 
 
-def _socks5_handshake(sock: socket.socket) -> bool:
+async def _socks5_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
     """
     SOCKS 5:  no-auth negotiation only (0x05 0x01 0x00).
     Expect 0x05 0x00 back.
     """
-    sock.sendall(b"\x05\x01\x00")
-    reply = sock.recv(2)
+    writer.write(b"\x05\x01\x00")
+    await writer.drain()
+    reply = await reader.readexactly(2)
     return reply == b"\x05\x00"
 
 
-def _http_probe(sock: socket.socket) -> bool:
+async def _http_connect_probe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
     """
-    HTTP proxy: send the lightest legal request (OPTIONS * ...).
-    A valid proxy will return an HTTP status line.
+    HTTP proxy: ask for a CONNECT tunnel to the verification host.
+    A valid proxy will return an HTTP status line; anything but 200 means no tunnel.
     """
-    sock.sendall(
-        b"OPTIONS * HTTP/1.1\r\n"
-        b"Host: example.com\r\n"
-        b"Connection: close\r\n\r\n"
+    writer.write(
+        b"CONNECT check.torproject.org:443 HTTP/1.1\r\n"
+        b"Host: check.torproject.org:443\r\n\r\n"
     )
-    reply = sock.recv(1024)  # 1 KiB is plenty for the tiny handshake responses expected
-    return reply.startswith(b"HTTP/1.")
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")  # status line + headers: the tunnel starts right after
+    status_line = head.split(b"\r\n", 1)[0].split()
+    return len(status_line) >= 2 and status_line[0].startswith(b"HTTP/1.") and status_line[1] == b"200"
 
 
-def test_proxy(proxy: ProxyInfo) -> ProxyInfo:
+async def _verify_over_tunnel(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+    """
+    HTTP proxy: what does_it_work does, but through the CONNECT tunnel already open,
+    saving a second TCP connection and proxy handshake.
     """
-    Populate proxy.ping (in seconds) if the proxy answers its handshake.
+    try:
+        async with asyncio.timeout(8):
+            await writer.start_tls(_SSL_CONTEXT, server_hostname="check.torproject.org")
+            writer.write(
+                b"GET /api/ip HTTP/1.0\r\n"
+                b"Host: check.torproject.org\r\n\r\n"
+            )
+            await writer.drain()
+            response = b""
+            while len(response) < 65536:  # the reply is ~60 bytes of JSON: don't let a proxy feed us forever
+                chunk = await reader.read(65536)
+                if not chunk:  # HTTP/1.0: the server closes the connection after the body
+                    break
+                response += chunk
+    except (asyncio.TimeoutError, OSError):
+        return False
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].split()
+    return len(status_line) >= 2 and status_line[1] == b"200" and _is_tor_check_reply(body)
+
+
+async def test_proxy(proxy: ProxyInfo, executor: Optional[Executor] = None) -> ProxyInfo:
+    """
+    Populate proxy.ping_ns (in nanoseconds) if the proxy answers its handshake.
     If it succeeds, then it makes a real request and sets proxy.works if it works out.
-    On failure, proxy.ping and proxy.works are left untouched.
+    HTTP proxies make the real request through the tunnel opened by the handshake,
+    the others through requests, run on executor (the loop's default one if None).
+    On failure, proxy.ping_ns and proxy.works are left untouched.
     """
     handlers = {
         "socks5": _socks5_handshake,
         "socks4": _socks4_handshake,
-        "http":   _http_probe,
-        "https":  _http_probe,  # HTTPS proxies behave the same for CONNECT
+        "http":   _http_connect_probe,
+        "https":  _http_connect_probe,  # HTTPS proxies behave the same for CONNECT
     }
     handshake = handlers.get(proxy.protocol.lower())
     if handshake is None:
         raise ValueError(f"Unsupported proxy protocol: {proxy.protocol!r}")
 
     try:
-        with socket.create_connection((proxy.ip, int(proxy.port)), timeout=8) as sock:
-            start = time.time()
-            if handshake(sock):
-                proxy.ping = time.time() - start
-                proxy.works = does_it_work(proxy)
-    except (socket.timeout, ConnectionError, OSError):
-        pass
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(proxy.ip, int(proxy.port)), timeout=8
+        )
+    except (asyncio.TimeoutError, OSError, ValueError):
+        return proxy
+    try:
+        start = time.monotonic_ns()
+        if not await asyncio.wait_for(handshake(reader, writer), timeout=8):
+            return proxy
+        proxy.ping_ns = time.monotonic_ns() - start
+        if handshake is _http_connect_probe:
+            proxy.works = await _verify_over_tunnel(reader, writer)
+        else:
+            writer.close()
+            # requests is blocking: keep it off the event loop
+            proxy.works = await asyncio.get_running_loop().run_in_executor(executor, does_it_work, proxy)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError, ValueError):
+        pass  # a misbehaving proxy must only fail its own probe, never the whole batch
+    finally:
+        writer.close()
     return proxy
 
 
+async def probe_many(proxies: List[ProxyInfo]) -> List[ProxyInfo]:
+    """
+    Run test_proxy on all the proxies concurrently, sharing one verification thread pool
+    (and the HTTP session) across the whole batch.
+    """
+    # Probing is latency-bound: keep many handshakes in flight, but not unboundedly many sockets
+    semaphore = asyncio.Semaphore(500)
+
+    async def bounded(proxy: ProxyInfo) -> ProxyInfo:
+        async with semaphore:
+            return await test_proxy(proxy, executor)
+
+    # One long-lived pool for the blocking verifications, capped since the work is IO-bound,
+    # and never larger than the batch itself; the caller's loop default executor is left alone
+    workers = min(64, len(proxies) or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify') as executor:
+        return await tqdm_asyncio.gather(*[bounded(p) for p in proxies])
+
+
 def get_data() -> Dict:
-    file_path = join(tempfile.gettempdir(), 'data.json')
-    if not isfile(file_path):
-        r = requests.get('https://raw.githubusercontent.com/proxifly/free-proxy-list/refs/heads/main/proxies/all/data.json')
-        with open(file_path, 'wb') as fp:
-            fp.write(r.content)
-            return json.loads(r.content)
-    with open(file_path) as fp:
-        return json.load(fp)
-
-
-def parse_data() -> List[ProxyInfo]:
-    raw_list = get_data()
-    proxy_list: List[ProxyInfo] = list()
-    for item in raw_list:
+    headers: Dict[str, str] = dict()
+    if _DATA_PATH.exists() and _ETAG_PATH.exists():
+        headers['If-None-Match'] = _ETAG_PATH.read_text().strip()
+    try:
+        r = _SESSION.get('https://raw.githubusercontent.com/proxifly/free-proxy-list/refs/heads/main/proxies/all/data.json',
+                         headers=headers, timeout=16)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        if not _DATA_PATH.exists():
+            raise
+        eprint(f'WARNING: using cached proxy list ({e})')
+    else:
+        if r.status_code != 304:  # 304 Not Modified => the cached copy is still current
+            _atomic_write(_DATA_PATH, r.content)
+            etag = r.headers.get('ETag')
+            if etag is not None:
+                _atomic_write(_ETAG_PATH, etag.encode())
+            else:
+                _ETAG_PATH.unlink(missing_ok=True)  # the old ETag does not describe the new body
+            return orjson.loads(r.content)
+    return orjson.loads(_DATA_PATH.read_bytes())
+
+
+def parse_data(two_letter_country_codes: Set[str]) -> Iterator[ProxyInfo]:
+    """
+    Yield the usable proxies located in the given countries.
+    Other items are skipped on the raw dict, before any object is built.
+    """
+    for item in get_data():
+        if item['geolocation']['country'] not in two_letter_country_codes:
+            continue
         if item['protocol'] == 'http' and not item['https']:
             # => proxy does not allow CONNECT tunnel
             continue  # We want encryption!
-        proxy = ProxyInfo(
+        yield ProxyInfo(
             proxy=item['proxy'],
             protocol=item['protocol'],
             ip=item['ip'],
@@ -163,65 +334,66 @@ def parse_data() -> List[ProxyInfo]:
             https=item['https'],
             anonymity=item['anonymity'],
             score=item['score'],
-            ping=float('inf'),
+            ping_ns=None,
             geolocation=Geolocation(**item['geolocation']),
             works=False
         )
-        proxy_list.append(proxy)
-    return proxy_list
 
 
 def pretty_print_results(proxies: List[ProxyInfo]) -> None:
     headers = ["Proxy", "Protocol", "IP", "Port", "Ping (s)", "Country", "City"]
-    rows = []
-    for p in proxies:
-        rows.append([
-            p.proxy,
-            p.protocol,
-            p.ip,
-            p.port,
-            f"{p.ping:.3f}",
-            p.geolocation.country,
-            p.geolocation.city or "-"
-        ])
-
-    # Determine column widths
-    col_widths = [max(len(str(cell)) for cell in [header] + [row[i] for row in rows]) for i, header in enumerate(headers)]
-
-    def format_row(row):
-        return " | ".join(str(cell).ljust(col_widths[i]) for i, cell in enumerate(row))
-
-    print(format_row(headers))
+    rows = [
+        (p.proxy, p.protocol, p.ip, str(p.port), f"{p.ping_ns / 1e9:.3f}", p.geolocation.country, p.geolocation.city or "-")
+        for p in proxies
+    ]
+
+    # Determine column widths (one pass per column)
+    col_widths = [max(map(len, col)) for col in zip(headers, *rows)]
+    format_spec = " | ".join(f"{{:<{w}}}" for w in col_widths)
+
+    print(format_spec.format(*headers))
     print("-+-".join("-" * w for w in col_widths))
     for row in rows:
-        print(format_row(row))
+        print(format_spec.format(*row))
 
 
-def main(two_letter_country_codes: Optional[Set[str]] = None, netmask: Optional[int] = None):
+def _subnet_key(ip: str, netmask: int, mask: int) -> object:
+    try:
+        # IPv4 fast path: plain integer math, no IPv4Network allocation
+        return struct.unpack('!I', socket.inet_aton(ip))[0] & mask
+    except OSError:
+        return ip_network(f"{ip}/{netmask}", strict=False)
+
+
+def main(two_letter_country_codes: Optional[Set[str]] = None, netmask: Optional[int] = None, as_json: bool = False):
+    log = eprint if as_json else print  # keep stdout clean for the JSON document
     if two_letter_country_codes is None:
         two_letter_country_codes = {geolocation_service()}
+        _geo_cache_flush()
 
-    data = [d for d in parse_data() if d.geolocation.country in two_letter_country_codes]
-    print(f'> Found {len(data)} proxies in {two_letter_country_codes}')
-
-    with multiprocessing.Pool() as pool:
-        results: List[ProxyInfo] = list(tqdm(pool.imap(test_proxy, data), total=len(data)))
-    results = [r for r in results if r.works and r.ping != float('inf')]
-    results.sort(key=lambda x: x.ping)
-    print(f'> Found {len(results)} working proxies')
+    data = list(parse_data(two_letter_country_codes))
+    log(f'> Found {len(data)} proxies in {two_letter_country_codes}')
 
     if netmask is not None:
-        seen = set()
-        deduped: List[ProxyInfo] = list()
-        for r in results:
-            subnet = ip_network(f"{r.ip}/{netmask}", strict=False)
-            if subnet not in seen:
-                seen.add(subnet)
-                deduped.append(r)
-        print(f'> Filtered by {netmask=} -> {len(deduped)} left')
-        results = deduped
-
-    pretty_print_results(results)
+        # Probe a single representative (the best scored) per subnet
+        mask = (0xFFFFFFFF << (32 - netmask)) & 0xFFFFFFFF
+        best: Dict[object, ProxyInfo] = dict()
+        for d in data:
+            key = _subnet_key(d.ip, netmask, mask)
+            if key not in best or d.score > best[key].score:
+                best[key] = d
+        data = list(best.values())
+        log(f'> Filtered by {netmask=} -> {len(data)} left')
+
+    results: List[ProxyInfo] = asyncio.run(probe_many(data))
+    results = [r for r in results if r.works and r.ping_ns is not None]
+    results.sort(key=lambda x: x.ping_ns)
+    log(f'> Found {len(results)} working proxies')
+
+    if as_json:
+        sys.stdout.buffer.write(orjson.dumps(results, option=orjson.OPT_SERIALIZE_DATACLASS | orjson.OPT_APPEND_NEWLINE))
+    else:
+        pretty_print_results(results)
 
 
 if __name__ == '__main__':
@@ -241,6 +413,10 @@ if __name__ == '__main__':
         help="CIDR subnet mask length to deduplicate proxies "
              "(e.g. 24 for /24). Omit for no subnet filtering."
     )
+    parser.add_argument(
+        "--json", dest="json", action="store_true",
+        help="Print the working proxies as a JSON array instead of a table."
+    )
     args = parser.parse_args()
     if args.subnet is not None and not (0 <= args.subnet <= 32):
         parser.error("Subnet mask length must be between 0 and 32")
@@ -249,6 +425,6 @@ if __name__ == '__main__':
         for cc in codes:
             if len(cc) != 2:
                 parser.error(f"'{cc}' is not a 2-letter country code")
-        main(codes, args.subnet)
+        main(codes, args.subnet, args.json)
     else:
-        main(netmask=args.subnet)
+        main(netmask=args.subnet, as_json=args.json)
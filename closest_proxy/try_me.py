@@ -1,4 +1,6 @@
-from main import ProxyInfo, Geolocation, test_proxy, get_url
+import asyncio
+
+from main import ProxyInfo, Geolocation, probe_many, get_url
 
 
 def ProxyInfo_builder(ip: str, port: int, protocol: str) -> ProxyInfo:
@@ -10,18 +12,18 @@ def ProxyInfo_builder(ip: str, port: int, protocol: str) -> ProxyInfo:
         https=protocol == 'https',
         anonymity='unknown',
         score=0,
-        ping=float('inf'),
+        ping_ns=None,
         geolocation=Geolocation(
             country='unknown',
             city='unknown'
         ),
         works=False
     )
-    return test_proxy(pi)
+    return pi
 
 
 if __name__ == '__main__':
-    pi = ProxyInfo_builder('127.0.0.1', 8080, 'http')
+    pi, = asyncio.run(probe_many([ProxyInfo_builder('127.0.0.1', 8080, 'http')]))
     assert pi.works
     test_url = 'https://ifconfig.co/json'
     res = get_url(test_url, pi)